@@ -20,13 +20,24 @@ Packages imports
 """
 import pygeos
 import numpy as np
+from math import hypot, sqrt, atan, atan2, cos, sin
+try:
+    from numba import njit, prange
+except ImportError:
+    # Numba unavailable : jitted functions run as plain (serial) Python
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda f: f
+    prange = range
 import time
 from shapely.geometry import Polygon, MultiPolygon, Point
 from shapely.affinity import translate, rotate, scale
-import copy
 from IPython.display import SVG, display, clear_output
-from scipy.optimize import minimize, LinearConstraint, NonlinearConstraint
+from scipy.spatial import cKDTree
 import matplotlib.pyplot as plt
+from matplotlib.patches import Circle, Rectangle, Polygon as PolygonPatch
+from matplotlib.transforms import Affine2D
 
 
 
@@ -39,18 +50,263 @@ Some useful functions
 
 # Check if a point is inside the cone from A, directed by v1 and v2 and containing B
 def is_inside_the_cone(point, pointA, pointB, v1, v2):
-    a_b = np.array(pointB) - np.array(pointA)
-    a_point = np.array(point) - np.array(pointA)
+    a_b = (pointB[0] - pointA[0], pointB[1] - pointA[1])
+    a_point = (point[0] - pointA[0], point[1] - pointA[1])
 
-    t1 = np.linalg.det(np.array((a_point, v1))) * np.linalg.det(np.array((a_b, v1)))
-    t2 = np.linalg.det(np.array((a_point, v2))) * np.linalg.det(np.array((a_b, v2)))
+    t1 = (a_point[0]*v1[1] - a_point[1]*v1[0]) * (a_b[0]*v1[1] - a_b[1]*v1[0])
+    t2 = (a_point[0]*v2[1] - a_point[1]*v2[0]) * (a_b[0]*v2[1] - a_b[1]*v2[0])
     
     return t1>=0 and t2>=0
 
 
 # Check if a point is inside a circle of center center and radius radius
 def is_inside_the_circle(point, center, radius):
-    return np.sum((center - point)**2) <= radius**2
+    dx = center[0] - point[0]
+    dy = center[1] - point[1]
+    return dx*dx + dy*dy <= radius*radius
+
+
+# Kernels are compiled without contraction nor reassociation : the choice between both exhaust
+# vectors is a tie on symmetric encounters, which must not depend on inlining, and the heading
+# solvers compare candidates within tolerances, so jitted and plain Python runs must agree
+_FASTMATH = {'nnan', 'ninf'}
+
+
+# Detect a conflict between aircraft A and B (positions a, b and headings ha, hb)
+# Returns the alert and the geometric features (vr, a_t1, a_t2) as scalars
+@njit('Tuple((b1, f8, f8, f8, f8, f8, f8))(f8, f8, f8, f8, f8, f8, f8, f8, f8, f8)',
+      cache=True, fastmath=_FASTMATH, inline='always')
+def _detect_conflict(ax, ay, bx, by, hax, hay, hbx, hby, d, tau):
+    # Computing geometrical features
+    abx, aby = bx - ax, by - ay
+    ro2 = abx*abx + aby*aby
+    ro = sqrt(ro2)
+    vrx, vry = hax - hbx, hay - hby
+    # Aircraft at the same position : conflict, but without any tangent (nor avoidance) direction
+    if ro2 == 0.:
+        return (True, vrx, vry, 0., 0., 0., 0.)
+    theta = atan(d/ro)
+
+    # tangent orientation vectors (rotations of a_b by theta and -theta)
+    c, s = cos(theta), sin(theta)
+    t1x, t1y = c*abx - s*aby, s*abx + c*aby
+    t2x, t2y = c*abx + s*aby, -s*abx + c*aby
+
+    # Check if relative speed lies in forbiden zone :
+    # inside the cone directed by a_t1 and a_t2 and containing a_b
+    in_cone = ((vrx*t1y - vry*t1x)*(abx*t1y - aby*t1x) >= 0
+                and (vrx*t2y - vry*t2x)*(abx*t2y - aby*t2x) >= 0)
+    # inside the circle of center a_b/tau and radius d/tau
+    dx, dy = abx/tau - vrx, aby/tau - vry
+    in_front_circle = dx*dx + dy*dy <= (d/tau)*(d/tau)
+    # outside the circle of center 0 and radius sqrt(ro**2 - d**2)/tau (always when ro < d)
+    beyond_circle = (vrx*vrx + vry*vry)*tau*tau > ro2 - d*d
+    alert = in_cone and (in_front_circle or beyond_circle)
+
+    return (alert, vrx, vry, t1x, t1y, t2x, t2y)
+
+
+# Compute exhaust vector (c vector in [Durand, 2018]) from scalar geometric features
+@njit('UniTuple(f8, 2)(f8, f8, f8, f8, f8, f8)', cache=True, fastmath=_FASTMATH, inline='always')
+def _exhaust_vector(vrx, vry, t1x, t1y, t2x, t2y):
+    n1_sq = t1x*t1x + t1y*t1y
+    n2_sq = t2x*t2x + t2y*t2y
+    # Degenerate tangents (aircraft at the same position) : null exhaust vector, i.e. no semi-plan
+    if n1_sq == 0. or n2_sq == 0.:
+        return (0., 0.)
+    k1 = (t1x*vrx + t1y*vry)/n1_sq
+    k2 = (t2x*vrx + t2y*vry)/n2_sq
+    c1x, c1y = k1*t1x - vrx, k1*t1y - vry
+    c2x, c2y = k2*t2x - vrx, k2*t2y - vry
+
+    # Shortest of both vectors
+    if c1x*c1x + c1y*c1y <= c2x*c2x + c2y*c2y:
+        return (c1x, c1y)
+    return (c2x, c2y)
+
+
+# Detect a conflict between aircraft A and B and, if any, write the (cx, cy, rhs) semi-plans
+# imposed on A by B into out_ij and on B by A into out_ji. Returns the alert
+# Conflict detection and exhaust vector are inlined : the whole pair is handled in a single pass
+@njit('b1(f8, f8, f8, f8, f8, f8, f8, f8, f8, f8, f8[::1], f8[::1])', cache=True, fastmath=_FASTMATH)
+def _pair_semi_plans(ax, ay, bx, by, hax, hay, hbx, hby, d, tau, out_ij, out_ji):
+    alert, vrx, vry, t1x, t1y, t2x, t2y = _detect_conflict(ax, ay, bx, by, hax, hay, hbx, hby, d, tau)
+    if alert:
+        cx, cy = _exhaust_vector(vrx, vry, t1x, t1y, t2x, t2y)
+        out_ij[0] = cx
+        out_ij[1] = cy
+        out_ij[2] = -(cx*(hax + cx/2) + cy*(hay + cy/2))
+        out_ji[0] = -cx
+        out_ji[1] = -cy
+        out_ji[2] = cx*(hbx - cx/2) + cy*(hby - cy/2)
+
+    return alert
+
+
+# Scan the candidate pairs of aircraft for conflicts and compute their semi-plans
+# For pair p = (i, j), semi_plan_ij[p] (resp. semi_plan_ji[p]) holds the (cx, cy, rhs) semi-plan
+# imposed on i by j (resp. on j by i) when alerts_out[p]
+@njit('void(f8[:, ::1], f8[:, ::1], i8[:, ::1], f8, f8, f8[:, ::1], f8[:, ::1], b1[::1])',
+      parallel=True, fastmath=_FASTMATH, cache=True)
+def _scan_pairs(positions, headings, pairs, d, tau, semi_plan_ij, semi_plan_ji, alerts_out):
+    # Iteration p only writes entries p of the output arrays : writes are disjoint
+    for p in prange(pairs.shape[0]):
+        i, j = pairs[p, 0], pairs[p, 1]
+        alerts_out[p] = _pair_semi_plans(positions[i, 0], positions[i, 1],
+                                         positions[j, 0], positions[j, 1],
+                                         headings[i, 0], headings[i, 1],
+                                         headings[j, 0], headings[j, 1],
+                                         d, tau, semi_plan_ij[p], semi_plan_ji[p])
+
+
+# Tolerance on linear constraints for a heading to be considered feasible
+FEASIBILITY_TOL = 1e-9
+
+
+# Check if heading h satisfies all linear constraints constraints[k, 0:2].h >= constraints[k, 2]
+@njit('b1(f8[:, ::1], f8, f8)', cache=True, fastmath=_FASTMATH)
+def _is_feasible(constraints, hx, hy):
+    for k in range(constraints.shape[0]):
+        if constraints[k, 0]*hx + constraints[k, 1]*hy < constraints[k, 2] - FEASIBILITY_TOL:
+            return False
+    return True
+
+
+# Intersections of the line a.h = b with the circle of center 0 and radius radius
+# Returns False (and dummy points) when they do not intersect
+@njit('Tuple((b1, f8, f8, f8, f8))(f8, f8, f8, f8)', cache=True, fastmath=_FASTMATH)
+def _line_circle_intersections(ax, ay, b, radius):
+    n2 = ax*ax + ay*ay
+    if n2 == 0.:
+        return (False, 0., 0., 0., 0.)
+    delta = radius*radius - b*b/n2
+    if delta < 0.:
+        return (False, 0., 0., 0., 0.)
+    # Foot of the perpendicular from 0 to the line, and half chord along the line
+    px, py = b*ax/n2, b*ay/n2
+    l = sqrt(delta/n2)
+    return (True, px + l*ay, py - l*ax, px - l*ay, py + l*ax)
+
+
+# Check if heading h is a rotation of heading h0 by an angle within [theta_min, theta_max] (turning arc)
+@njit('b1(f8, f8, f8, f8, f8, f8)', cache=True, fastmath=_FASTMATH)
+def _in_turning_arc(hx, hy, h0x, h0y, theta_min, theta_max):
+    angle = atan2(h0x*hy - h0y*hx, h0x*hx + h0y*hy)
+    return theta_min - FEASIBILITY_TOL <= angle <= theta_max + FEASIBILITY_TOL
+
+
+# Ends of the turning arc : heading h0 rotated by theta_min and by theta_max
+@njit('UniTuple(f8, 4)(f8, f8, f8, f8)', cache=True, fastmath=_FASTMATH)
+def _turning_arc_ends(h0x, h0y, theta_min, theta_max):
+    c_min, s_min = cos(theta_min), sin(theta_min)
+    c_max, s_max = cos(theta_max), sin(theta_max)
+    return (c_min*h0x - s_min*h0y, s_min*h0x + c_min*h0y, c_max*h0x - s_max*h0y, s_max*h0x + c_max*h0y)
+
+
+# Closest heading to h_star on the circle of center 0 and radius radius satisfying all linear constraints,
+# within the turning arc of the current heading h0
+# The optimum is either h_star itself, an end of the arc or an intersection of a constraint boundary with the circle
+@njit('Tuple((b1, f8, f8))(f8[:, ::1], f8, f8, f8, f8, f8, f8, f8)', cache=True, fastmath=_FASTMATH)
+def _closest_heading(constraints, hsx, hsy, radius, h0x, h0y, theta_min, theta_max):
+    if _is_feasible(constraints, hsx, hsy) and _in_turning_arc(hsx, hsy, h0x, h0y, theta_min, theta_max):
+        return (True, hsx, hsy)
+
+    e1x, e1y, e2x, e2y = _turning_arc_ends(h0x, h0y, theta_min, theta_max)
+    candidates = [(e1x, e1y), (e2x, e2y)]
+    for k in range(constraints.shape[0]):
+        cut, h1x, h1y, h2x, h2y = _line_circle_intersections(constraints[k, 0], constraints[k, 1],
+                                                             constraints[k, 2], radius)
+        if cut:
+            candidates.append((h1x, h1y))
+            candidates.append((h2x, h2y))
+
+    found, best_x, best_y, best_dist = False, hsx, hsy, 0.
+    for hx, hy in candidates:
+        if _is_feasible(constraints, hx, hy) and _in_turning_arc(hx, hy, h0x, h0y, theta_min, theta_max):
+            dist = (hx - hsx)**2 + (hy - hsy)**2
+            if not found or dist < best_dist:
+                found, best_x, best_y, best_dist = True, hx, hy, dist
+
+    return (found, best_x, best_y)
+
+
+# Largest violation of the linear constraints by heading h, as distances to the constraint boundaries
+@njit('f8(f8[:, ::1], f8, f8)', cache=True, fastmath=_FASTMATH)
+def _max_violation(constraints, hx, hy):
+    violation = 0.
+    for k in range(constraints.shape[0]):
+        n = sqrt(constraints[k, 0]**2 + constraints[k, 1]**2)
+        if n > 0.:
+            violation = max(violation, (constraints[k, 2] - constraints[k, 0]*hx - constraints[k, 1]*hy)/n)
+    return violation
+
+
+# Heading on the turning arc of the current heading h0 (on the circle of center 0 and radius radius)
+# minimizing the largest constraint violation (used when no heading satisfies all constraints),
+# ties being broken by the distance to h_star. The turning rate is not relaxed : constraints only hold
+# the semi-plans. The optimum is either an end of the arc, a heading along the normal of a constraint
+# (least violation of that single constraint) or lies where the violations of two constraints are equal
+# (intersection of a line with the circle)
+@njit('UniTuple(f8, 2)(f8[:, ::1], f8, f8, f8, f8, f8, f8, f8)', cache=True, fastmath=_FASTMATH)
+def _least_violation_heading(constraints, hsx, hsy, radius, h0x, h0y, theta_min, theta_max):
+    K = constraints.shape[0]
+    # Normalized constraints (unit normal vectors)
+    normalized = np.zeros_like(constraints)
+    for k in range(K):
+        n = sqrt(constraints[k, 0]**2 + constraints[k, 1]**2)
+        if n > 0.:
+            normalized[k, :] = constraints[k, :]/n
+
+    e1x, e1y, e2x, e2y = _turning_arc_ends(h0x, h0y, theta_min, theta_max)
+    candidates = [(e1x, e1y), (e2x, e2y)]
+    for k in range(K):
+        if normalized[k, 0] == 0. and normalized[k, 1] == 0.:
+            continue
+        hx, hy = radius*normalized[k, 0], radius*normalized[k, 1]
+        if _in_turning_arc(hx, hy, h0x, h0y, theta_min, theta_max):
+            candidates.append((hx, hy))
+        for l in range(k+1, K):
+            if normalized[l, 0] == 0. and normalized[l, 1] == 0.:
+                continue
+            cut, h1x, h1y, h2x, h2y = _line_circle_intersections(normalized[k, 0] - normalized[l, 0],
+                                                                 normalized[k, 1] - normalized[l, 1],
+                                                                 normalized[k, 2] - normalized[l, 2], radius)
+            if cut:
+                for hx, hy in ((h1x, h1y), (h2x, h2y)):
+                    if _in_turning_arc(hx, hy, h0x, h0y, theta_min, theta_max):
+                        candidates.append((hx, hy))
+
+    best_x, best_y = e1x, e1y
+    best_violation = _max_violation(constraints, e1x, e1y)
+    best_dist = (e1x - hsx)**2 + (e1y - hsy)**2
+    for hx, hy in candidates:
+        violation = _max_violation(constraints, hx, hy)
+        dist = (hx - hsx)**2 + (hy - hsy)**2
+        if (violation < best_violation - FEASIBILITY_TOL
+                or (violation <= best_violation + FEASIBILITY_TOL and dist < best_dist)):
+            best_x, best_y, best_violation, best_dist = hx, hy, violation, dist
+
+    return (best_x, best_y)
+
+
+# Run every jitted function once on dummy data, so that loading them (from
+# the disk cache or by compiling) happens on import rather than during the first simulation step
+def warmup():
+    _detect_conflict(0., 0., 10., 0., 1., 0., -1., 0., 1., 1.)
+    _exhaust_vector(2., 0., 1., 0.1, 1., -0.1)
+    _pair_semi_plans(0., 0., 10., 0., 1., 0., -1., 0., 1., 1., np.empty(3), np.empty(3))
+    _scan_pairs(np.array(((0., 0.), (10., 0.))), np.array(((1., 0.), (-1., 0.))), np.array(((0, 1),), dtype=np.int64),
+                1., 1., np.empty((1, 3)), np.empty((1, 3)), np.zeros(1, dtype=np.bool_))
+    _is_feasible(np.array(((0., 1., 0.5),)), 1., 0.)
+    _line_circle_intersections(0., 1., 0.5, 1.)
+    _in_turning_arc(1., 0., 1., 0., -0.1, 0.1)
+    _turning_arc_ends(1., 0., -0.1, 0.1)
+    _closest_heading(np.array(((0., 1., 0.5),)), 1., 0., 1., 1., 0., -0.1, 0.1)
+    _max_violation(np.array(((0., 1., 0.5),)), 1., 0.)
+    _least_violation_heading(np.array(((0., 1., 0.5), (0., -1., 0.5))), 1., 0., 1., 1., 0., -0.1, 0.1)
+
+
+warmup()
 
 
 
@@ -62,9 +318,6 @@ Aircraft representation
 
 class Aircraft:
 
-    theta_max = np.radians(9)
-    theta_min = np.radians(-9)
-    
     def __init__(self, position, heading, destination):
         self.position = np.array(position)
         self.trajectory = [np.array(position)]
@@ -73,133 +326,91 @@ class Aircraft:
         self.destination = destination
         self.semi_plan = []
 
+    # Set turning rates and cache the corresponding rotation matrices
     @classmethod
-    def set_turning_rates(theta_min = np.radians(-9), theta_max = np.radians(9)):
-        Aircraft.theta_min = theta_min
-        Aircraft.theta_max = theta_max
+    def set_turning_rates(cls, theta_min = np.radians(-9), theta_max = np.radians(9)):
+        cls.theta_min = theta_min
+        cls.theta_max = theta_max
+        cls._R_MAX = np.array(( (np.cos(theta_max), -np.sin(theta_max)),
+                               (np.sin(theta_max),  np.cos(theta_max)) ))
+        cls._R_MIN = np.array(( (np.cos(theta_min), -np.sin(theta_min)),
+                               (np.sin(theta_min),  np.cos(theta_min)) ))
 
 
     def detect_conflict(self, other, d, tau):
-        # Computing geometrical features
-        a_b = other.position - self.position
-        ro = np.linalg.norm(a_b)
-        vr = self.heading - other.heading
-        theta = np.arctan(d/ro)
-        
-        # tangent orientation vectors
-        r1 = np.array(( (np.cos(theta), -np.sin(theta)),
-                       (np.sin(theta),  np.cos(theta)) ))
-        r2 = np.array(( (np.cos(theta), np.sin(theta)),
-                       (-np.sin(theta),  np.cos(theta)) ))    
-        a_t1 = r1.dot(a_b)
-        a_t2 = r2.dot(a_b)
-
+        alert, vrx, vry, t1x, t1y, t2x, t2y = _detect_conflict(self.position[0], self.position[1],
+                                                               other.position[0], other.position[1],
+                                                               self.heading[0], self.heading[1],
+                                                               other.heading[0], other.heading[1],
+                                                               float(d), float(tau))
         # Gathering geometric features in a tuple
-        geom = (vr, a_t1, a_t2, )
-        # Check if relative speed lies in forbiden zone
-        point = self.position + vr
-        radius = (1/tau)*np.sqrt(ro**2 - d**2)
-        alert = (is_inside_the_cone(point, self.position, other.position, a_t1, a_t2)
-                    and (is_inside_the_circle(vr, a_b/tau, d/tau) 
-                       or not is_inside_the_circle(vr, np.array((0,0)), radius)))
+        geom = ((vrx, vry), (t1x, t1y), (t2x, t2y), )
 
         return (alert, geom)
 
 
     # Compute exhaust vector (c vector in [Durand, 2018])
     def exhaust_vector(self, vr, a_t1, a_t2):
-        u1 = (a_t1.dot(vr)/np.linalg.norm(a_t1)**2)*a_t1
-        u2 = (a_t2.dot(vr)/np.linalg.norm(a_t2)**2)*a_t2
-        c1 = u1 - vr
-        c2 = u2 - vr
+        return np.array(_exhaust_vector(vr[0], vr[1], a_t1[0], a_t1[1], a_t2[0], a_t2[1]))
 
-        return c1*(np.linalg.norm(c1) <= np.linalg.norm(c2)) + c2*(np.linalg.norm(c1) > np.linalg.norm(c2))
 
+    # Compute semi-plans of both aircraft from the (alert, geom) result of detect_conflict
+    def compute_semi_plan(self, other, conflict):
+        alert, geom = conflict
 
-    def compute_semi_plan(self, other, d, tau):
-        alert, geom = self.detect_conflict(other, d, tau)
-        
-        if alert:
-            vr, a_t1, a_t2 = geom
-            c = self.exhaust_vector(vr, a_t1, a_t2)
-            p_ij = list(c) + list([c.dot(-(self.heading + c/2))])
-            p_ji = list(-c) + list([c.dot(other.heading - c/2)])
+        if not alert:
+            return [], []
 
-            yield [p_ij]
-            yield [p_ji]
+        vr, a_t1, a_t2 = geom
+        c = self.exhaust_vector(vr, a_t1, a_t2)
+        p_ij = list(c) + list([c.dot(-(self.heading + c/2))])
+        p_ji = list(-c) + list([c.dot(other.heading - c/2)])
 
-        else:
-            yield []
-            yield []
+        return [p_ij], [p_ji]
 
 
     def compute_heading(self):
 
         if not self.semi_plan:
             #print('No conflict, I move toward destination')
-            h_ideal = (self.destination - self.position)/np.linalg.norm((self.destination - self.position))
+            diff = self.destination - self.position
+            h_ideal = diff/hypot(diff[0], diff[1])
             return h_ideal
         
         else:
             #print('A conflict will occur within Tau seconds !')
-            # Objective function (distance to ideal heading)
-            def obj(h):
-                h_star = self.destination - self.position
-                h_star = (np.linalg.norm(self.heading)/np.linalg.norm(h_star))*h_star
-                return (h_star[0]-h[0])**2 + (h_star[1]-h[1])**2
-
-            def obj_jac(h):
-                h_star = self.destination - self.position
-                h_star = (np.linalg.norm(self.heading)/np.linalg.norm(h_star))*h_star
-                return [-2*(h_star[0] - h[0]), -2*(h_star[1] - h[1])]
-
-            def obj_hess(h):
-                return np.array(( (2,0), (0,2) ))
-            
-            # Linear constraints (semi-plan constraints + turning rate constraints)
-            r_max = np.array(( (np.cos(Aircraft.theta_max), -np.sin(Aircraft.theta_max)),
-                        (np.sin(Aircraft.theta_max),  np.cos(Aircraft.theta_max)) ))
-            r_min = np.array(( (np.cos(Aircraft.theta_min), -np.sin(Aircraft.theta_min)),
-                        (np.sin(Aircraft.theta_min),  np.cos(Aircraft.theta_min)) ))
-            h_max = r_max.dot(self.heading)
-            h_min = r_min.dot(self.heading)
-
-            turning_rate_constraints = [[h_max[1], -h_max[0]], [h_min[1], -h_min[0]]]
-
-            lin_const_list = [sp[0:-1] for sp in self.semi_plan] + turning_rate_constraints
-            nb_lin_constr = len(lin_const_list)
-
-            lb = [-sp[-1] for sp in self.semi_plan] + list(np.zeros(len(turning_rate_constraints)))
-            ub = list(np.inf*np.ones(nb_lin_constr))
-
-            linear_constraint = LinearConstraint(lin_const_list, lb, ub)
-            
-            # Non linear constraint (constant speed constraint)
-            def cs_constraint(h):
-                return h[0]**2 + h[1]**2 - np.linalg.norm(self.heading)**2
-            
-            def cs_jacobian(h):
-                return [2*h[0], 2*h[1]]
-            
-            def cs_hessian(h,v):
-                return v[0]*np.array(( (2,0), (0,2) ))
-
-            nonlinear_constraint = NonlinearConstraint(cs_constraint, 0, 0, jac=cs_jacobian, hess=cs_hessian)
-
-            # Solving the optimization problem
-
-            x0 = self.heading
-            res = minimize(obj, x0, method='trust-constr', jac=obj_jac, hess=obj_hess,
-                        constraints=[linear_constraint, nonlinear_constraint])
-            return np.array(res.x)
+            # Linear constraints (semi-plan constraints + turning rate constraints) : A.h >= b
+            # Turning rate constraints keep h clockwise from h_max and counterclockwise from h_min
+            h_max = self._R_MAX.dot(self.heading)
+            h_min = self._R_MIN.dot(self.heading)
+
+            semi_plan = np.array(self.semi_plan)
+            A = np.vstack((semi_plan[:, 0:-1], (h_max[1], -h_max[0]), (-h_min[1], h_min[0])))
+            b = np.concatenate((-semi_plan[:, -1], (0., 0.)))
+
+            # Ideal heading (toward destination, at constant speed)
+            diff = self.destination - self.position
+            h_norm = hypot(self.heading[0], self.heading[1])
+            d_norm = hypot(diff[0], diff[1])
+            h_star = (h_norm/d_norm)*diff
+            h_star_x, h_star_y = float(h_star[0]), float(h_star[1])
+
+            # Closed-form solution of the problem, the heading staying within the turning arc
+            constraints = np.column_stack((A, b))
+            arc = (float(self.heading[0]), float(self.heading[1]), float(self.theta_min), float(self.theta_max))
+            found, hx, hy = _closest_heading(constraints, h_star_x, h_star_y, h_norm, *arc)
+            if not found:
+                # No feasible heading : heading within the turning arc least violating the semi-plans,
+                # at constant speed
+                hx, hy = _least_violation_heading(constraints[:-2], h_star_x, h_star_y, h_norm, *arc)
+            return np.array((hx, hy))
 
 
     def reached_destination(self, epsilon=3):
-        return np.linalg.norm(self.destination - self.position) <= epsilon
+        return hypot(self.destination[0] - self.position[0], self.destination[1] - self.position[1]) <= epsilon
 
 
-    def move(self, ts):
-        self.position += ts*self.heading
+Aircraft.set_turning_rates()
          
 
 
@@ -223,9 +434,56 @@ class Simulation:
         self.alerts = 0
         self.separation_losses = 0
         self.done = False
+        # Aircraft states are stored as (N, 2) arrays, each aircraft holding views on its rows
+        self.positions = np.stack([ac.position for ac in aircraft]).astype(float)
+        self.headings = np.stack([ac.heading for ac in aircraft]).astype(float)
+        self.destinations = np.stack([ac.destination for ac in aircraft]).astype(float)
+        for i, ac in enumerate(aircraft):
+            ac.position = self.positions[i]
+            ac.heading = self.headings[i]
+            ac.destination = self.destinations[i]
+        # Aircraft that reached their destination, updated after each move
+        self.reached = self.reached_destinations(epsilon=3)
+        # Figure used by display, created on first call
+        self.fig = None
 
 
     def display(self):
+        # Create the figure and aircraft patches once, later calls only move them
+        if self.fig is None:
+            self.fig, self.ax = plt.subplots()
+            if self.fig.canvas.required_interactive_framework is None:
+                # Non-interactive backend (e.g. inline in notebooks) : the figure is only shown through display
+                plt.close(self.fig)
+            self.ax.set_xlim(0, self.area_size)
+            self.ax.set_ylim(0, self.area_size)
+            self.ax.set_aspect('equal')
+            # Square area
+            self.ax.add_patch(Rectangle((0, 0), self.area_size, self.area_size, fill=False))
+            # Aircrafts (separation and inner circles)
+            self._circles = [self.ax.add_patch(Circle(tuple(ac.position), self.d, fill=False)) for ac in self.aircraft]
+            self._inner_circles = [self.ax.add_patch(Circle(tuple(ac.position), 3, fill=False)) for ac in self.aircraft]
+            # Heading vectors (arrow pointing along x axis, placed by its transform)
+            arrow = Polygon([(0,-25), (37.5, 15), (25, 20), (50, 25), (45, 0), (40, 12.5)])
+            arrow = scale(rotate(arrow, -45), xfact=0.80, yfact=0.80)
+            self._arrows = [self.ax.add_patch(PolygonPatch(np.array(arrow.exterior.coords))) for ac in self.aircraft]
+
+        for circle, inner_circle, arrow, ac in zip(self._circles, self._inner_circles, self._arrows, self.aircraft):
+            circle.center = tuple(ac.position)
+            inner_circle.center = tuple(ac.position)
+            arrow.set_transform(Affine2D().rotate(np.arctan2(ac.heading[1], ac.heading[0]))
+                                          .translate(ac.position[0], ac.position[1]) + self.ax.transData)
+        if self.fig.canvas.required_interactive_framework is None:
+            # Non-interactive backend : redisplay the figure in place of the previous one
+            clear_output(wait=True)
+            display(self.fig)
+        else:
+            self.fig.canvas.draw()
+            self.fig.canvas.flush_events()
+
+
+    # Display the current state as a SVG image (slow, for snapshots only)
+    def snapshot(self):
         # Square area
         square = Polygon([(0,0), (0, self.area_size), (self.area_size, self.area_size), (self.area_size, 0)])
         # Aircrafts
@@ -263,12 +521,18 @@ class Simulation:
                                   fc=tuple(np.array((1., 0.8, 0.8))*(self.separation_losses>0) + np.array((0.8, 1., 0.8))*(self.separation_losses==0)),))
 
 
-    def move(self):
+    # Boolean array flagging the aircraft that reached their destination
+    def reached_destinations(self, epsilon=3):
+        dist2 = np.sum((self.destinations - self.positions)**2, axis=1)
+        return dist2 <= epsilon*epsilon
+
+
+    def move(self, reached):
+        # Move all aircraft that have not reached their destination at once
+        self.positions += self.time_step*self.headings*(~reached)[:, None]
         for aircraft in self.aircraft:
-            if not aircraft.reached_destination(): 
-                aircraft.move(self.time_step)
-            aircraft.trajectory.append(copy.deepcopy(aircraft.position))
-            aircraft.headings.append(copy.deepcopy(aircraft.heading))
+            aircraft.trajectory.append(aircraft.position.copy())
+            aircraft.headings.append(aircraft.heading.copy())
 
 
     def run_one_step(self, display=False):
@@ -276,35 +540,44 @@ class Simulation:
             print('Simulation is over')
         else:
             N = len(self.aircraft)
-            done = True
-            
+
+            # Candidate pairs : a conflict within tau requires ro <= d + tau*|vr| (front circle, and a fortiori
+            # ro**2 <= d**2 + (tau*|vr|)**2 beyond it) and |vr| <= 2*v_max
+            v_max = np.sqrt(np.max(np.sum(self.headings**2, axis=1)))
+            pairs = cKDTree(self.positions).query_pairs(r=self.d + 2*self.tau*v_max, output_type='ndarray')
+
+            # Detect conflicts and compute semi-plans for candidate pairs
+            semi_plan_ij = np.empty((len(pairs), 3))
+            semi_plan_ji = np.empty((len(pairs), 3))
+            alerts = np.zeros(len(pairs), dtype=np.bool_)
+            _scan_pairs(self.positions, self.headings, pairs, float(self.d), float(self.tau),
+                        semi_plan_ij, semi_plan_ji, alerts)
+            self.alerts += int(alerts.sum())
+
+            for (i, j), p_ij, p_ji in zip(pairs[alerts], semi_plan_ij[alerts], semi_plan_ji[alerts]):
+                self.aircraft[i].semi_plan.append(p_ij)
+                self.aircraft[j].semi_plan.append(p_ji)
+
             for i in range(N):
-                # Compute semi-plans
-                for j in range(i+1, N):
-                    alert = self.aircraft[i].detect_conflict(self.aircraft[j], self.d, self.tau)[0]
-                    self.alerts += int(alert)
-                    p_ij, p_ji = self.aircraft[i].compute_semi_plan(self.aircraft[j], self.d, self.tau)
-                    self.aircraft[i].semi_plan.extend(p_ij)
-                    self.aircraft[j].semi_plan.extend(p_ji)
                 # Compute new heading
                 new_heading = self.aircraft[i].compute_heading()
-                self.aircraft[i].heading = new_heading
+                self.headings[i] = new_heading
                 # Reinitialize semi-plan to empty lists
                 self.aircraft[i].semi_plan = []
-                
-                # update done 
-                done *= self.aircraft[i].reached_destination(epsilon=3)
-                self.done = done
             
             # Move aircrafts according to new headings and increment step count
-            self.move()
+            self.move(self.reached)
             self.step += 1
             self.time += self.time_step
 
+            # update done
+            self.reached = self.reached_destinations(epsilon=3)
+            self.done = bool(self.reached.all())
+
             # Check if separation losses occurs
-            for i in range(N):
-                for j in range(i+1, N):
-                    self.separation_losses += int((np.linalg.norm(self.aircraft[i].position - self.aircraft[j].position) < self.d))
+            close = cKDTree(self.positions).query_pairs(r=self.d, output_type='ndarray')
+            ro = np.linalg.norm(self.positions[close[:, 0]] - self.positions[close[:, 1]], axis=1)
+            self.separation_losses += int(np.sum(ro < self.d))
             #display
             if display:
                 self.display()